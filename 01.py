@@ -1,3 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache
+from itertools import repeat
+import mmap
+import os
+
+import numpy as np
 import pytest
 
 DIGIT_NAMES = "zero one two three four five six seven eight nine".split()
@@ -22,18 +29,156 @@ def end_digit(line, match_on_words, reverse=False):
     return 0
 
 
+class DigitScanner:
+    """
+    Aho-Corasick automaton over the digit patterns, so a line's first and last
+    digit come out of a single left-to-right pass, overlaps included:
+
+        e i g h t w o
+                ^ eight ends here (starts at 0)
+                    ^ two ends here (starts at 4)
+    """
+
+    def __init__(self, match_on_words):
+        patterns = {str(value): value for value in range(10)}
+        if match_on_words:
+            patterns.update({word: value for value, word in enumerate(DIGIT_NAMES)})
+
+        # trie
+        children = [{}]
+        found = [[]]
+        for word, value in patterns.items():
+            state = 0
+            for chr_ in word:
+                if chr_ not in children[state]:
+                    children[state][chr_] = len(children)
+                    children.append({})
+                    found.append([])
+                state = children[state][chr_]
+            found[state].append((len(word), value))
+
+        # breadth-first, so each state's fallback is complete before it is used
+        self.delta = [dict(children[0])]
+        self.delta.extend({} for _ in children[1:])
+        fail = [0] * len(children)
+        queue = list(children[0].values())
+        for state in queue:
+            found[state].extend(found[fail[state]])
+            self.delta[state] = dict(self.delta[fail[state]])
+            for chr_, child in children[state].items():
+                fail[child] = self.delta[fail[state]].get(chr_, 0)
+                self.delta[state][chr_] = child
+                queue.append(child)
+
+        # only the longest (earliest start) and shortest (latest start) match
+        # at each state can be the first or last digit on the line
+        self.first = [max(f, default=None) for f in found]
+        self.last = [min(f, default=None) for f in found]
+
+    def first_last(self, line):
+        delta, first, last = self.delta, self.first, self.last
+        state = 0
+        first_start = last_start = None
+        first_value = last_value = 0
+        for i, chr_ in enumerate(line):
+            state = delta[state].get(chr_, 0)
+            if last[state] is None:
+                continue
+            length, value = first[state]
+            if first_start is None or i - length < first_start:
+                first_start, first_value = i - length, value
+            length, value = last[state]
+            if last_start is None or i - length > last_start:
+                last_start, last_value = i - length, value
+        return first_value, last_value
+
+
+@cache
+def digit_scanner(match_on_words):
+    return DigitScanner(match_on_words)
+
+
 def first_last_digit_value(line, match_on_words):
-    first_digit = end_digit(line, match_on_words=match_on_words)
-    last_digit = end_digit(line, match_on_words=match_on_words, reverse=True)
+    first_digit, last_digit = digit_scanner(match_on_words).first_last(line)
     return first_digit * 10 + last_digit
 
 
-def total_from_file(filename, match_on_words=True):
-    with open(filename, encoding="utf-8") as file:
-        return sum(
-            first_last_digit_value(line, match_on_words)
-            for line in file.read().splitlines()
+def total_from_text(text, match_on_words):
+    scanner = digit_scanner(match_on_words)
+    return sum(
+        first * 10 + last for first, last in map(scanner.first_last, text.splitlines())
+    )
+
+
+def literal_digit_total(buffer):
+    """
+    Sum of first/last literal digit per line of a raw byte buffer, without
+    visiting lines one at a time: digit bytes are tagged with their line number
+    (count of preceding line breaks), and since those tags are sorted, each
+    line's first and last digit sit at the edges of its run of tags
+
+    Lines may end in "\n", "\r\n" or "\r".
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    line_breaks = np.flatnonzero((data == ord("\n")) | (data == ord("\r")))
+    digit_at = np.flatnonzero((data >= ord("0")) & (data <= ord("9")))
+    if not digit_at.size:
+        return 0
+    values = data[digit_at].astype(np.int64) - ord("0")
+    lines = np.searchsorted(line_breaks, digit_at)
+    run_start = np.flatnonzero(np.diff(lines, prepend=-1))
+    run_end = np.append(run_start[1:], len(lines)) - 1
+    return int((values[run_start] * 10 + values[run_end]).sum())
+
+
+def total_from_bytes(buffer, match_on_words):
+    if not match_on_words:
+        return literal_digit_total(buffer)
+    return total_from_text(bytes(buffer).decode("utf-8"), match_on_words)
+
+
+def chunk_bounds(buffer, chunks):
+    """Split buffer into roughly equal (start, stop) spans which end on newlines"""
+    bounds = [0]
+    for i in range(1, chunks):
+        cut = buffer.find(b"\n", max(bounds[-1], len(buffer) * i // chunks))
+        if cut == -1:
+            break
+        bounds.append(cut + 1)
+    bounds.append(len(buffer))
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def _total_from_span(filename, start, stop, match_on_words):
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return total_from_bytes(buffer[start:stop], match_on_words)
+
+
+def total_from_file(filename, match_on_words=True, workers=None):
+    """
+    Sum calibration values for a file; with `workers` set, the file is memory
+    mapped and newline-aligned chunks are summed by that many processes
+    """
+    if workers is None:
+        with open(filename, "rb") as file:
+            return total_from_bytes(file.read(), match_on_words)
+
+    if os.path.getsize(filename) == 0:
+        return 0
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            spans = chunk_bounds(buffer, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        starts, stops = zip(*spans)
+        totals = pool.map(
+            _total_from_span,
+            repeat(filename),
+            starts,
+            stops,
+            repeat(match_on_words),
         )
+        return sum(totals)
 
 
 @pytest.mark.parametrize(
@@ -65,6 +210,26 @@ def test_word_and_literal_digits(test_input, expected):
     assert first_last_digit_value(test_input, match_on_words=True) == expected
 
 
+@pytest.mark.parametrize(
+    "test_input,match_on_words",
+    [
+        ("eightwo", True),
+        ("oneight", True),
+        ("twone", True),
+        ("sevenine", True),
+        ("nineight3", True),
+        ("abc", True),
+        ("", False),
+        ("x9y", False),
+        ("one2three", False),
+    ],
+)
+def test_scanner_matches_end_digit(test_input, match_on_words):
+    first, last = digit_scanner(match_on_words).first_last(test_input)
+    assert first == end_digit(test_input, match_on_words)
+    assert last == end_digit(test_input, match_on_words, reverse=True)
+
+
 def test_1a_from_file():
     assert total_from_file("01a_test.txt", match_on_words=False) == 142
 
@@ -73,6 +238,35 @@ def test_1b_from_file():
     assert total_from_file("01b_test.txt") == 281
 
 
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "abc",
+        "1abc2\npqr3stu8vwx\na1b2c3d4e5f\ntreb7uchet\n",
+        "no digits\n\n7\r\nx12y\nend 5",
+        "99\r b9a\r...\r4\r\n56",
+    ],
+)
+def test_literal_digit_total(text):
+    expected = total_from_text(text, match_on_words=False)
+    assert literal_digit_total(text.encode()) == expected
+
+
+def test_chunk_bounds():
+    buffer = b"ab\ncd\nef\ngh"
+    assert chunk_bounds(buffer, 1) == [(0, 11)]
+    assert chunk_bounds(buffer, 2) == [(0, 6), (6, 11)]
+    assert chunk_bounds(buffer, 4) == [(0, 3), (3, 6), (6, 9), (9, 11)]
+    assert chunk_bounds(buffer, 20) == [(0, 3), (3, 6), (6, 9), (9, 11)]
+
+
+@pytest.mark.parametrize("match_on_words", [False, True])
+def test_parallel_matches_serial(match_on_words):
+    serial = total_from_file("01_input.txt", match_on_words)
+    assert total_from_file("01_input.txt", match_on_words, workers=2) == serial
+
+
 def test_1a_valid_result():
     assert total_from_file("01_input.txt", match_on_words=False) == 54877
 
@@ -1,4 +1,13 @@
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import reduce
+import io
+from itertools import islice, repeat
+import json
+from operator import add
+
+import numpy as np
+import pytest
 
 
 @dataclass()
@@ -32,19 +41,171 @@ def parse_games(games_list: str):
         yield int(game_num), (Draw.from_str(draw) for draw in draws.split(";"))
 
 
+@dataclass
+class GameColumns:
+    """One row per draw, grouped by game in input order"""
+
+    COLOURS = ("red", "green", "blue")
+
+    game_id: np.ndarray
+    draw_index: np.ndarray
+    red: np.ndarray
+    green: np.ndarray
+    blue: np.ndarray
+
+    @classmethod
+    def from_str(cls, games_list: str):
+        columns = [[], [], [], [], []]
+        game_id, draw_index, *cubes = columns
+        for line in games_list.splitlines():
+            if not line:
+                continue
+            game, _, draws = line.partition(":")
+            game_num = int(game.partition(" ")[2])
+            for i, draw in enumerate(draws.split(";")):
+                game_id.append(game_num)
+                draw_index.append(i)
+                counts = [0, 0, 0]
+                for chunk in draw.split(","):
+                    num, _, colour = chunk.strip().partition(" ")
+                    counts[cls.COLOURS.index(colour)] = int(num)
+                for column, count in zip(cubes, counts):
+                    column.append(count)
+        return cls(*(np.array(c, dtype=np.int64) for c in columns))
+
+    @property
+    def game_starts(self):
+        return np.flatnonzero(self.draw_index == 0)
+
+    def game_ids(self):
+        return self.game_id[self.game_starts]
+
+    def check_games(self, max_draw: Draw):
+        # matches Draw.__lt__: within the limit on every colour, but not equal
+        within = (
+            (self.red <= max_draw.red)
+            & (self.green <= max_draw.green)
+            & (self.blue <= max_draw.blue)
+        )
+        equal = (
+            (self.red == max_draw.red)
+            & (self.green == max_draw.green)
+            & (self.blue == max_draw.blue)
+        )
+        possible = np.logical_and.reduceat(within & ~equal, self.game_starts)
+        return self.game_ids()[possible]
+
+    def max_draws(self):
+        starts = self.game_starts
+        return [
+            np.maximum.reduceat(self.red, starts),
+            np.maximum.reduceat(self.green, starts),
+            np.maximum.reduceat(self.blue, starts),
+        ]
+
+    def min_draw_power(self):
+        red, green, blue = self.max_draws()
+        return red * green * blue
+
+    def draw_reaches_max(self, max_draws=None):
+        """Per game, whether a single draw equals the game's maxima on all colours"""
+        max_draws = max_draws or self.max_draws()
+        game = np.cumsum(self.draw_index == 0) - 1
+        reaches = np.ones_like(self.red, dtype=bool)
+        for column, maxima in zip((self.red, self.green, self.blue), max_draws):
+            reaches &= column == maxima[game]
+        return np.logical_or.reduceat(reaches, self.game_starts)
+
+
 def check_games(max_draw: Draw, games_list: str):
-    for game_num, draws in parse_games(games_list):
-        if all(draw < max_draw for draw in draws):
-            yield game_num
+    yield from GameColumns.from_str(games_list).check_games(max_draw).tolist()
 
 
 def min_draw_power(games_list: str):
-    for _, draws in parse_games(games_list):
-        draws = tuple(draws)  # cache for reuse
-        red = max(draw.red for draw in draws)
-        green = max(draw.green for draw in draws)
-        blue = max(draw.blue for draw in draws)
-        yield red * green * blue
+    yield from GameColumns.from_str(games_list).min_draw_power().tolist()
+
+
+@dataclass
+class GameTally:
+    """
+    Partial answers for one shard of a game log
+
+    Possible game id sums and power sums simply add up, so tallies built per
+    shard (in any order, in any process) combine with `+` into the tally of
+    the concatenated log. As check_games rejects a draw that equals the limit
+    exactly, a game whose maxima equal a limit is only rejected when one draw
+    reaches all three maxima at once.
+    """
+
+    limits: tuple[tuple[int, int, int], ...]
+    id_sums: list[int]
+    power_sum: int = 0
+
+    @classmethod
+    def empty(cls, max_draws: list[Draw]):
+        limits = tuple((d.red, d.green, d.blue) for d in max_draws)
+        return cls(limits, [0] * len(limits))
+
+    @classmethod
+    def from_file(cls, file, max_draws: list[Draw], chunk_lines=10_000):
+        tally = cls.empty(max_draws)
+        while chunk := list(islice(file, chunk_lines)):
+            tally.add_games(GameColumns.from_str("".join(chunk)))
+        return tally
+
+    def add_games(self, games: GameColumns):
+        if not games.game_id.size:
+            return
+        limits = np.array(self.limits, dtype=np.int64).reshape(-1, 3)
+        max_draws = games.max_draws()
+        reached = games.draw_reaches_max(max_draws)[:, np.newaxis]
+        maxima = np.stack(max_draws, axis=1)[:, np.newaxis, :]
+        within = (maxima <= limits).all(axis=2)
+        equal = (maxima == limits).all(axis=2) & reached
+        possible_ids = (within & ~equal) * games.game_ids()[:, np.newaxis]
+        self.id_sums = [
+            a + int(b) for a, b in zip(self.id_sums, possible_ids.sum(axis=0))
+        ]
+        red, green, blue = max_draws
+        self.power_sum += int((red * green * blue).sum())
+
+    def __add__(self, other: "GameTally"):
+        if self.limits != other.limits:
+            raise ValueError("Can only merge tallies for the same limits")
+        id_sums = [a + b for a, b in zip(self.id_sums, other.id_sums)]
+        return GameTally(self.limits, id_sums, self.power_sum + other.power_sum)
+
+    def to_json(self):
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str):
+        fields = json.loads(text)
+        limits = tuple(tuple(limit) for limit in fields["limits"])
+        return cls(limits, fields["id_sums"], fields["power_sum"])
+
+
+def evaluate_game_log(file, max_draws: list[Draw], chunk_lines=10_000):
+    """
+    Answer many check_games limits and min_draw_power in one pass over a file,
+    reading `chunk_lines` games at a time
+
+    Returns ([sum of possible game ids per limit], sum of min draw powers)
+    """
+    tally = GameTally.from_file(file, max_draws, chunk_lines)
+    return tally.id_sums, tally.power_sum
+
+
+def _tally_shard(filename, max_draws):
+    with open(filename, encoding="utf-8") as f:
+        return GameTally.from_file(f, max_draws)
+
+
+def tally_shards(filenames, max_draws: list[Draw], workers=None):
+    """Merged GameTally of several shard files, each tallied in a worker process"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tallies = pool.map(_tally_shard, filenames, repeat(max_draws))
+        return reduce(add, tallies, GameTally.empty(max_draws))
 
 
 MAX_DRAW = Draw(red=12, green=13, blue=14)
@@ -63,6 +224,20 @@ Game 5: 6 red, 1 blue, 3 green; 2 blue, 1 red, 2 green
 """
 
 
+def test_game_columns():
+    games = GameColumns.from_str(TEST_INPUT)
+    assert games.game_id.tolist()[:4] == [1, 1, 1, 2]
+    assert games.draw_index.tolist()[:4] == [0, 1, 2, 0]
+    assert games.red.tolist()[:3] == [4, 1, 0]
+    assert games.green.tolist()[:3] == [0, 2, 2]
+    assert games.blue.tolist()[:3] == [3, 6, 0]
+    assert games.game_ids().tolist() == [1, 2, 3, 4, 5]
+
+
+def test_check_game_excludes_exact_limit():
+    assert list(check_games(MAX_DRAW, "Game 7: 12 red, 13 green, 14 blue")) == []
+
+
 def test_check_game():
     assert list(check_games(MAX_DRAW, TEST_INPUT)) == [1, 2, 5]
 
@@ -79,3 +254,51 @@ def test_min_draw_power():
 def test_02b():
     with open("02_input.txt", encoding="utf-8") as f:
         assert sum(min_draw_power(f.read())) == 67335
+
+
+def test_evaluate_game_log():
+    limits = [
+        MAX_DRAW,
+        Draw(red=0, green=0, blue=0),
+        Draw(red=6, green=3, blue=2),  # game 5's maxima, not reached by one draw
+        Draw(red=14, green=3, blue=15),  # game 4's maxima, reached by one draw
+        Draw(red=99, green=99, blue=99),
+    ]
+    with io.StringIO(TEST_INPUT) as f:
+        id_sums, power = evaluate_game_log(f, limits, chunk_lines=2)
+    assert id_sums == [sum(check_games(d, TEST_INPUT)) for d in limits]
+    assert id_sums == [8, 0, 5, 8, 15]
+    assert power == sum(min_draw_power(TEST_INPUT))
+
+
+def test_02_batch():
+    with open("02_input.txt", encoding="utf-8") as f:
+        assert evaluate_game_log(f, [MAX_DRAW]) == ([2512], 67335)
+
+
+def test_merge_shard_tallies():
+    limits = [MAX_DRAW, Draw(red=14, green=3, blue=15)]
+    lines = TEST_INPUT.splitlines(keepends=True)
+    shards = [io.StringIO("".join(lines[:2])), io.StringIO("".join(lines[2:]))]
+    tallies = [GameTally.from_file(f, limits) for f in shards]
+    tallies = [GameTally.from_json(t.to_json()) for t in tallies]
+    merged = tallies[1] + tallies[0]
+    assert merged == GameTally.from_file(io.StringIO(TEST_INPUT), limits)
+    assert merged.id_sums == [8, 8]
+    assert merged.power_sum == 2286
+
+
+def test_merge_rejects_different_limits():
+    with pytest.raises(ValueError):
+        GameTally.empty([MAX_DRAW]) + GameTally.empty([Draw()])
+
+
+def test_02_shards(tmp_path):
+    with open("02_input.txt", encoding="utf-8") as f:
+        lines = f.readlines()
+    shards = []
+    for i in range(0, len(lines), 30):
+        shards.append(tmp_path / f"shard_{i}.txt")
+        shards[-1].write_text("".join(lines[i : i + 30]), encoding="utf-8")
+    tally = tally_shards(shards, [MAX_DRAW], workers=2)
+    assert (tally.id_sums, tally.power_sum) == ([2512], 67335)
@@ -1,5 +1,11 @@
+from collections import deque
 from dataclasses import dataclass
+from functools import cached_property
+import io
+from itertools import chain
+import re
 
+import numpy as np
 import pytest
 
 
@@ -9,7 +15,7 @@ class PartNum:
     row: int
     col: int
 
-    @property
+    @cached_property
     def width(self):
         return len(str(self.val))
 
@@ -22,12 +28,17 @@ class PartNum:
         )
 
 
+def is_symbol(chr_: str):
+    return not (chr_.isalnum() or chr_.isspace() or chr_ == ".")
+
+
 class Schematic:
     def __init__(self, text: str):
         self.lines = text.splitlines()
         self.width = len(self.lines[0])
         self.height = len(self.lines)
         self.parts = list(self._gen_partnums())
+        self.part_ids = self._index_parts()
         self.gears = list(self._locate_gears())
 
     def get_chr(self, x, y):
@@ -36,7 +47,21 @@ class Schematic:
         return self.lines[y][x]
 
     def sum_adjacent_partnums(self):
-        return sum(p.val for p in self.parts if self._adjacent_symbol(p))
+        ids = set()
+        for row_num, row in enumerate(self.lines):
+            for col_num, chr_ in enumerate(row):
+                if is_symbol(chr_):
+                    ids.update(self._adjacent_part_ids(col_num, row_num))
+        return sum(self.parts[i].val for i in ids)
+
+    def parts_adjacent_to_symbol(self, symbol: str):
+        """Parts next to at least one `symbol`, in reading order"""
+        ids = set()
+        for row_num, row in enumerate(self.lines):
+            for col_num, chr_ in enumerate(row):
+                if chr_ == symbol:
+                    ids.update(self._adjacent_part_ids(col_num, row_num))
+        return [self.parts[i] for i in sorted(ids)]
 
     def sum_dual_gears(self):
         dual_gears = [g for g in self.gears if len(g) == 2]
@@ -52,36 +77,100 @@ class Schematic:
                     yield PartNum(val=int(next_), row=row_num, col=col_num - len(next_))
                     next_ = ""
             if next_:
-                yield PartNum(val=int(next_), row=row_num, col=self.width - len(next_))
-
-    def _adjacent_symbol(self, part: PartNum):
-        def is_symbol(chr_: str):
-            return not (chr_.isalnum() or chr_.isspace() or chr_ == ".")
-
-        left = part.col - 1
-        right = part.col + part.width
-        top = part.row - 1
-        bottom = part.row + 1
-
-        for x in range(left, right + 1):
-            for y in (top, bottom):
-                if is_symbol(self.get_chr(x, y)):
-                    return True
-
-        for x in (left, right):
-            if is_symbol(self.get_chr(x, part.row)):
-                return True
-
-        return False
+                yield PartNum(val=int(next_), row=row_num, col=len(row) - len(next_))
+
+    def _index_parts(self):
+        """Grid of the index into self.parts covering each cell, or None"""
+        part_ids = [[None] * len(line) for line in self.lines]
+        for i, part in enumerate(self.parts):
+            for col_num in range(part.col, part.col + part.width):
+                part_ids[part.row][col_num] = i
+        return part_ids
+
+    def _adjacent_part_ids(self, x, y):
+        ids = set()
+        for row in self.part_ids[max(y - 1, 0) : y + 2]:
+            ids.update(row[max(x - 1, 0) : x + 2])
+        ids.discard(None)
+        return sorted(ids)
 
     def _locate_gears(self):
         for row_num, row in enumerate(self.lines):
             for col_num, chr_ in enumerate(row):
                 if chr_ == "*":
-                    adjacent_parts = [
-                        p.val for p in self.parts if p.adjacent(row_num, col_num)
-                    ]
-                    yield (adjacent_parts)
+                    adjacent_ids = self._adjacent_part_ids(col_num, row_num)
+                    yield [self.parts[i].val for i in adjacent_ids]
+
+
+def array_sum_adjacent_partnums(text: str):
+    """
+    Schematic.sum_adjacent_partnums with whole-grid array operations: the
+    symbol mask is dilated over a 3x3 neighbourhood, and each run of digits
+    counts if any of its cells is in the dilated mask (part numbers must fit
+    in an int64)
+    """
+    lines = text.splitlines()
+    # pad rows to one width, plus a "." column so digit runs don't wrap rows
+    width = max(map(len, lines), default=0) + 1
+    rows = "".join(line.ljust(width, ".") for line in lines)
+    grid = np.frombuffer(rows.encode(), dtype=np.uint8).reshape(len(lines), width)
+
+    digit = (grid >= ord("0")) & (grid <= ord("9"))
+    letter = ((grid | 0x20) >= ord("a")) & ((grid | 0x20) <= ord("z"))
+    blank = np.isin(grid, np.frombuffer(b". \t", dtype=np.uint8))
+    symbol = np.pad(~(digit | letter | blank), 1)
+    height, width = grid.shape
+    near_symbol = np.zeros_like(grid, dtype=bool)
+    for dy in range(3):
+        for dx in range(3):
+            near_symbol |= symbol[dy : dy + height, dx : dx + width]
+
+    digit = digit.ravel()
+    digit_at = np.flatnonzero(digit)
+    if not digit_at.size:
+        return 0
+    run_starts = np.flatnonzero(np.diff(digit_at, prepend=-2) != 1)
+    run_ends = np.append(run_starts[1:], digit_at.size)
+    run_of = np.repeat(np.arange(run_starts.size), run_ends - run_starts)
+    place = run_ends[run_of] - 1 - np.arange(digit_at.size)
+    digits = grid.ravel()[digit_at].astype(np.int64) - ord("0")
+    values = np.add.reduceat(digits * 10**place, run_starts)
+    counts = np.logical_or.reduceat(near_symbol.ravel()[digit_at], run_starts)
+    return int(values[counts].sum())
+
+
+def stream_schematic_totals(file):
+    """
+    (sum_adjacent_partnums, sum_dual_gears) of a schematic read line by line
+
+    Each row is settled once the row below it has been read, so only a window
+    of three rows and their part spans is held, however tall the schematic.
+    """
+    part_sum = gear_sum = 0
+    window = deque([("", [])], maxlen=3)
+    for line in chain(file, [""]):
+        line = line.rstrip("\r\n")
+        spans = [(m.start(), m.end(), int(m[0])) for m in re.finditer(r"\d+", line)]
+        window.append((line, spans))
+        if len(window) < 3:
+            continue
+        row, parts = window[1]
+        for start, end, val in parts:
+            neighbourhood = (text[max(start - 1, 0) : end + 1] for text, _ in window)
+            if any(is_symbol(c) for c in chain(*neighbourhood)):
+                part_sum += val
+        for col_num, chr_ in enumerate(row):
+            if chr_ != "*":
+                continue
+            adjacent = [
+                val
+                for _, near_parts in window
+                for start, end, val in near_parts
+                if start - 1 <= col_num <= end
+            ]
+            if len(adjacent) == 2:
+                gear_sum += adjacent[0] * adjacent[1]
+    return part_sum, gear_sum
 
 
 TEST_INPUT = """\
@@ -147,6 +236,26 @@ def test_adjacent_symbol(schematic):
 
 def test_adjacent_partnum_sums():
     assert Schematic(TEST_INPUT).sum_adjacent_partnums() == 4361
+    assert array_sum_adjacent_partnums(TEST_INPUT) == 4361
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "......",
+        "123...\n...*..\n.....5",
+        "..12\n34*.\n....",
+        "a12#\n.5b.",
+        "9\n#\n9",
+        "467..\n*..\n.5.",
+        "..\n12#",
+        "..\n123.",
+        "..\n123*",
+        "*.\n.123",
+    ],
+)
+def test_array_engine_matches(text):
+    assert array_sum_adjacent_partnums(text) == Schematic(text).sum_adjacent_partnums()
 
 
 @pytest.mark.parametrize(
@@ -191,6 +300,25 @@ def test_find_gears():
     assert s.gears == [[467, 35], [617], [755, 598]]
 
 
+def test_part_index():
+    s = Schematic(TEST_INPUT)
+    assert s.part_ids[0][:8] == [0, 0, 0, None, None, 1, 1, 1]
+    assert s.part_ids[1] == [None] * 10
+
+
+def test_parts_adjacent_to_symbol():
+    s = Schematic(TEST_INPUT)
+    assert [p.val for p in s.parts_adjacent_to_symbol("*")] == [
+        467,
+        35,
+        617,
+        755,
+        598,
+    ]
+    assert [p.val for p in s.parts_adjacent_to_symbol("$")] == [664]
+    assert s.parts_adjacent_to_symbol("%") == []
+
+
 def test_sum_dual_gears():
     s = Schematic(TEST_INPUT)
     assert s.sum_dual_gears() == 467835
@@ -202,7 +330,23 @@ def test_03a():
         assert sch.sum_adjacent_partnums() == 538046
 
 
+def test_03a_array_engine():
+    with open("03_input.txt", encoding="utf-8") as f:
+        assert array_sum_adjacent_partnums(f.read()) == 538046
+
+
 def test_03b():
     with open("03_input.txt", encoding="utf-8") as f:
         sch = Schematic(f.read())
         assert sch.sum_dual_gears() == 81709807
+
+
+def test_stream_totals():
+    assert stream_schematic_totals(io.StringIO(TEST_INPUT)) == (4361, 467835)
+    assert stream_schematic_totals(io.StringIO("12*3")) == (15, 36)
+    assert stream_schematic_totals(io.StringIO("")) == (0, 0)
+
+
+def test_03_stream():
+    with open("03_input.txt", encoding="utf-8") as f:
+        assert stream_schematic_totals(f) == (538046, 81709807)
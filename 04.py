@@ -1,3 +1,4 @@
+from collections import defaultdict
 from dataclasses import dataclass
 
 
@@ -21,11 +22,16 @@ class Card:
         card_number, _, winning_held = card.partition(":")
         card_number = int(card_number[4:])
         winning, _, held = winning_held.partition("|")
-        winning = set(winning.split())
-        held = set(held.split())
-        matches = len(winning & held)
+        matches = (cls.bitmask(winning) & cls.bitmask(held)).bit_count()
         return cls(card_number, matches)
 
+    @staticmethod
+    def bitmask(numbers: str):
+        mask = 0
+        for n in numbers.split():
+            mask |= 1 << int(n)
+        return mask
+
     @classmethod
     def parse_text(cls, text: str):
         cards = text.strip().splitlines()
@@ -43,12 +49,33 @@ def score_cards(cards: str) -> int:
 
 
 def count(cards: str) -> int:
-    cards = list(Card.parse_text(cards))
-    copy_count = {c.number: 1 for c in cards}
-    for c in cards:
-        for n in range(c.matches):
-            copy_count[c.number + n + 1] += copy_count[c.number]
-    return sum(copy_count.values())
+    return count_lines(cards.strip().splitlines())
+
+
+def count_lines(lines) -> int:
+    """
+    Total cards won, in one pass over the card lines
+
+    A card with n copies and m matches adds n copies to each of the next m
+    cards, so rather than visiting them all, the change is noted where it
+    starts and where it stops, and a running total picks it up.
+    """
+    total = extra_copies = 0
+    copies_change = defaultdict(int)
+    cards = (Card.from_str(line) for line in lines if line.strip())
+    for i, card in enumerate(cards):
+        extra_copies += copies_change.pop(i, 0)
+        copies = 1 + extra_copies
+        total += copies
+        if card.matches:
+            copies_change[i + 1] += copies
+            copies_change[i + card.matches + 1] -= copies
+    return total
+
+
+def test_bitmask():
+    assert Card.bitmask(" 1  3 ") == 0b1010
+    assert Card.bitmask("") == 0
 
 
 def test_score_card():
@@ -72,3 +99,8 @@ def test_count_cards():
 def test_04b():
     with open("04_input.txt", encoding="utf-8") as f:
         assert count(f.read()) == 11024379
+
+
+def test_04b_stream():
+    with open("04_input.txt", encoding="utf-8") as f:
+        assert count_lines(f) == 11024379
@@ -1,7 +1,12 @@
-from dataclasses import dataclass
+from bisect import bisect_right
+from dataclasses import InitVar, dataclass
 from functools import reduce
+import hashlib
+import os
+import random
 from typing import Self
 
+import numpy as np
 import pytest
 
 
@@ -41,6 +46,7 @@ class Map:
     source_name: str
     dest_name: str
     elements: list[Elem]
+    arrays: InitVar[tuple | None] = None
 
     @classmethod
     def from_str(cls, text: str):
@@ -51,7 +57,37 @@ class Map:
         elements = [cls.Elem.from_str(x) for x in lines[1:]]
         return cls(x, y, elements)
 
-    def __post_init__(self):
+    @classmethod
+    def from_breakpoints(cls, source_name, dest_name, breakpoints, offsets, mapped):
+        """
+        Map over existing breakpoint, offset and mapped-flag arrays (e.g.
+        memory-mapped), used as they are; `elements` is only built if asked for
+        """
+        return cls(source_name, dest_name, None, (breakpoints, offsets, mapped))
+
+    @property
+    def elements(self) -> list[Elem]:
+        if self._elements is None:
+            # segments flagged as mapped, leaving out the gaps between them
+            bounds = zip(self.breakpoints.tolist(), self.breakpoints[1:].tolist())
+            self._elements = [
+                Map.Elem(range(a, b), offset)
+                for (a, b), offset, mapped in zip(
+                    bounds, self.offsets.tolist(), self.mapped.tolist()
+                )
+                if mapped
+            ]
+        return self._elements
+
+    @elements.setter
+    def elements(self, elements: list[Elem]):
+        self._elements = elements
+
+    def __post_init__(self, arrays):
+        if arrays is not None:
+            self.breakpoints, self.offsets, self.mapped = arrays
+            self._breakpoint_array, self._offset_array = self.breakpoints, self.offsets
+            return
         elements = sorted(self.elements, key=lambda e: e.source_range.start)
         merged_elements = [elements[0]]
         for e in elements[1:]:
@@ -60,6 +96,28 @@ class Map:
             else:
                 merged_elements.append(e)
         self.elements = merged_elements
+        self._build_breakpoints()
+
+    def _build_breakpoints(self):
+        """
+        Offset applied from each breakpoint up to the next, gaps included
+
+        0-50 +2, 60-70 -5  ->  breakpoints (0, 50, 60, 70), offsets (2, 0, -5, 0),
+                                mapped (1, 0, 1, 0)
+        """
+        self.breakpoints = []
+        self.offsets = []
+        self.mapped = []
+        for e in self.elements:
+            if self.breakpoints and self.breakpoints[-1] == e.source_range.start:
+                self.breakpoints.pop()
+                self.offsets.pop()
+                self.mapped.pop()
+            self.breakpoints += [e.source_range.start, e.source_range.stop]
+            self.offsets += [e.offset, 0]
+            self.mapped += [1, 0]
+        self._breakpoint_array = np.array(self.breakpoints, dtype=np.int64)
+        self._offset_array = np.array(self.offsets, dtype=np.int64)
 
     def reduce(self, other: Self):
         """
@@ -94,28 +152,81 @@ class Map:
         98-100  -63 35-37
         """
         assert self.dest_name == other.source_name
-        breakpoints = set(e.dest_range.start for e in self.elements)
-        breakpoints.update(e.dest_range.stop for e in self.elements)
-        breakpoints.update(e.source_range.start for e in other.elements)
-        breakpoints.update(e.source_range.stop for e in other.elements)
-        breakpoints = sorted(list(breakpoints))
+        # walk both maps' intermediate ranges in order, cutting at every edge
+        ranges_a = sorted(
+            (e.dest_range.start, e.dest_range.stop, e.offset) for e in self.elements
+        )
+        ranges_b = [
+            (e.source_range.start, e.source_range.stop, e.offset)
+            for e in other.elements
+        ]
+        a = min(r[0] for r in ranges_a[:1] + ranges_b[:1])
+        i = j = 0
         elements = []
-        for a, b in zip(breakpoints, breakpoints[1:]):
-            offset_a = next((x.offset for x in self.elements if a in x.dest_range), 0)
-            offset_b = next(
-                (x.offset for x in other.elements if a in x.source_range), 0
-            )
+        while True:
+            while i < len(ranges_a) and ranges_a[i][1] <= a:
+                i += 1
+            while j < len(ranges_b) and ranges_b[j][1] <= a:
+                j += 1
+            if i == len(ranges_a) and j == len(ranges_b):
+                break
+            offset_a, next_a = offset_and_edge(ranges_a, i, a)
+            offset_b, next_b = offset_and_edge(ranges_b, j, a)
+            b = min(edge for edge in (next_a, next_b) if edge is not None)
             offset = offset_a + offset_b
             elements.append(Map.Elem(range(a - offset_a, b - offset_a), offset))
+            a = b
 
         return Map(self.source_name, other.dest_name, elements)
 
     def transform(self, x):
-        for elem in self.elements:
-            result = elem.transform(x)
-            if result is not None:
-                return result
-        return x
+        i = bisect_right(self.breakpoints, x) - 1
+        return x + int(self.offsets[i]) if i >= 0 else x
+
+    def transform_many(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        i = np.searchsorted(self._breakpoint_array, values, side="right") - 1
+        offsets = self._offset_array[np.maximum(i, 0)]
+        return values + np.where(i >= 0, offsets, 0)
+
+    def transform_range(self, values: range):
+        """
+        Split `values` at each breakpoint, and offset each piece
+
+        seed-to-soil, 45-100
+        45-50   +0  45-50   (not mapped)
+        50-98   +2  52-100
+        98-100  -48 50-52
+        """
+        pieces = []
+        start = values.start
+        i = bisect_right(self.breakpoints, start) - 1
+        while start < values.stop:
+            offset = int(self.offsets[i]) if i >= 0 else 0
+            stop = values.stop
+            if i + 1 < len(self.breakpoints):
+                stop = min(int(self.breakpoints[i + 1]), stop)
+            pieces.append(range(start + offset, stop + offset))
+            start = stop
+            i += 1
+        return pieces
+
+
+def offset_and_edge(ranges: list[tuple[int, int, int]], i, point):
+    """
+    Offset at `point` and the next edge after it, given sorted (start, stop,
+    offset) ranges of which ranges[i] is the first not stopping by `point`
+    """
+    if i == len(ranges):
+        return 0, None
+    start, stop, offset = ranges[i]
+    if point < start:
+        return 0, start
+    return offset, stop
+
+
+CACHE_MAGIC = int.from_bytes(b"aoc23-05", "little")
+CACHE_VERSION = 2
 
 
 class Almanac:
@@ -123,35 +234,79 @@ class Almanac:
         elem = almanac.split("\n\n")
 
         _, _, seeds = elem[0].partition("seeds: ")
-        self.seeds = [int(x) for x in seeds.split()]
+        self._set_seeds([int(x) for x in seeds.split()])
+
+        self.map = reduce(lambda a, b: a.reduce(b), (Map.from_str(x) for x in elem[1:]))
 
+    def _set_seeds(self, seeds):
+        self.seeds = seeds
         seed_ranges = zip(self.seeds[::2], self.seeds[1::2])
         self.seed_ranges = [range(a, a + b) for (a, b) in seed_ranges]
 
-        self.map = reduce(lambda a, b: a.reduce(b), (Map.from_str(x) for x in elem[1:]))
+    @classmethod
+    def cached(cls, almanac: str, cache_dir) -> Self:
+        """
+        Almanac from a compiled copy in `cache_dir`, keyed on a hash of the text
+
+        The copy is one int64 .npy array, memory-mapped on reload and used in
+        place: [magic, format version, name word count, seed count, *map names
+        as UTF-8 padded to whole words, *seeds, *breakpoints, *offsets,
+        *mapped]. A copy in any other format is compiled again
+        """
+        digest = hashlib.sha256(almanac.encode()).hexdigest()
+        path = os.path.join(cache_dir, f"almanac-v{CACHE_VERSION}-{digest}.npy")
+        try:
+            packed = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            packed = None
+        if (
+            packed is not None
+            and packed.dtype == np.int64
+            and packed.ndim == 1
+            and packed[:2].tolist() == [CACHE_MAGIC, CACHE_VERSION]
+        ):
+            name_words, seed_count = packed[2:4].tolist()
+            names, seeds, maps = np.split(
+                packed[4:], [name_words, name_words + seed_count]
+            )
+            source_name, dest_name = names.tobytes().rstrip(b"\0").decode().split()
+            self = cls.__new__(cls)
+            self._set_seeds(seeds.tolist())
+            self.map = Map.from_breakpoints(source_name, dest_name, *np.split(maps, 3))
+            return self
+
+        self = cls(almanac)
+        names = f"{self.map.source_name} {self.map.dest_name}".encode()
+        names = np.frombuffer(names.ljust(-(-len(names) // 8) * 8, b"\0"), np.int64)
+        packed = np.concatenate(
+            [
+                [CACHE_MAGIC, CACHE_VERSION, len(names), len(self.seeds)],
+                names,
+                self.seeds,
+                self.map.breakpoints,
+                self.map.offsets,
+                self.map.mapped,
+            ]
+        ).astype(np.int64)
+        os.makedirs(cache_dir, exist_ok=True)
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as f:
+            np.save(f, packed)
+        os.replace(partial, path)
+        return self
 
     def min_location_per_seed(self):
-        return min(self.map.transform(x) for x in self.seeds)
+        return int(self.map.transform_many(self.seeds).min())
 
     def min_location_by_range(self):
-        def in_range(seed):
-            for seed_range in self.seed_ranges:
-                if seed in seed_range:
-                    return True
-            return False
-
-        loc_ranges = [e.dest_range for e in self.map.elements]
-        loc_ranges = sorted(loc_ranges, key=lambda e: e.start)
-        for loc_range in loc_ranges:
-            print(loc_range)
-            for i, location in enumerate(loc_range):
-                if i % 10000 == 0:
-                    print(f"{i:8}{location}")
-                for e in self.map.elements:
-                    if location not in e.dest_range:
-                        continue
-                    if in_range(location - e.offset):
-                        return location
+        return min(
+            (
+                loc_range.start
+                for seed_range in self.seed_ranges
+                for loc_range in self.map.transform_range(seed_range)
+            ),
+            default=None,
+        )
 
 
 @pytest.fixture(name="map_seed_soil")
@@ -184,6 +339,12 @@ def test_merge_map_elements(map_soil_fertilizer):
     ]
 
 
+def test_map_breakpoints():
+    seed_soil = Map.from_str("seed-to-soil map:\n2 0 50\n55 60 10\n48 50 2\n")
+    assert seed_soil.breakpoints == [0, 50, 52, 60, 70]
+    assert seed_soil.offsets == [2, -2, 0, -5, 0]
+
+
 def test_reduce_maps(map_seed_soil, map_soil_fertilizer):
     new_map: Map = map_seed_soil.reduce(map_soil_fertilizer)
     assert new_map.source_name == "seed"
@@ -200,6 +361,38 @@ def test_reduce_maps(map_seed_soil, map_soil_fertilizer):
     ]
 
 
+def test_offset_and_edge():
+    ranges = [(0, 15, 2), (30, 40, 3)]
+    assert offset_and_edge(ranges, 0, 10) == (2, 15)
+    assert offset_and_edge(ranges, 1, 15) == (0, 30)
+    assert offset_and_edge(ranges, 1, 30) == (3, 40)
+    assert offset_and_edge(ranges, 2, 40) == (0, None)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_reduce_matches_composition(seed):
+    rng = random.Random(seed)
+
+    def random_map(source, dest):
+        # almanac maps shuffle blocks of 0-100 around, as in the puzzle input
+        cuts = [0, *sorted(rng.sample(range(1, 100), 6)), 100]
+        blocks = [range(a, b) for a, b in zip(cuts, cuts[1:])]
+        dest_blocks = rng.sample(blocks, len(blocks))
+        dest_starts = [0]
+        for block in dest_blocks:
+            dest_starts.append(dest_starts[-1] + len(block))
+        elements = [
+            Map.Elem(block, start - block.start)
+            for block, start in zip(dest_blocks, dest_starts)
+        ]
+        return Map(source, dest, elements)
+
+    first, second = random_map("a", "b"), random_map("b", "c")
+    composed = first.reduce(second)
+    for x in range(-10, 160):
+        assert composed.transform(x) == second.transform(first.transform(x))
+
+
 @pytest.mark.parametrize(
     "seed,soil",
     [
@@ -213,6 +406,25 @@ def test_seed_to_soil(map_seed_soil, seed, soil):
     assert map_seed_soil.transform(seed) == soil
 
 
+def test_transform_many(map_seed_soil):
+    seeds = np.arange(-5, 110)
+    expected = [map_seed_soil.transform(x) for x in seeds.tolist()]
+    assert map_seed_soil.transform_many(seeds).tolist() == expected
+
+
+@pytest.mark.parametrize(
+    "seeds,soil",
+    [
+        (range(45, 100), [range(45, 50), range(52, 100), range(50, 52)]),
+        (range(60, 70), [range(62, 72)]),
+        (range(0, 10), [range(0, 10)]),
+        (range(97, 105), [range(99, 100), range(50, 52), range(100, 105)]),
+    ],
+)
+def test_seed_range_to_soil(map_seed_soil, seeds, soil):
+    assert map_seed_soil.transform_range(seeds) == soil
+
+
 TEST_ALMANAC = """\
 seeds: 79 14 55 13
 
@@ -278,14 +490,81 @@ def test_05a():
         assert almanac.min_location_per_seed() == 662197086
 
 
+def test_cached_almanac(tmp_path):
+    first = Almanac.cached(TEST_ALMANAC, tmp_path)
+    assert len(list(tmp_path.iterdir())) == 1
+    reloaded = Almanac.cached(TEST_ALMANAC, tmp_path)
+    assert isinstance(reloaded.map.breakpoints, np.memmap)
+    assert reloaded.seeds == first.seeds == [79, 14, 55, 13]
+    assert reloaded.seed_ranges == first.seed_ranges
+    assert reloaded.map.breakpoints.tolist() == first.map.breakpoints
+    assert reloaded.map.offsets.tolist() == first.map.offsets
+    assert reloaded.map.elements == first.map.elements
+    assert reloaded.map.transform(79) == 82
+    assert reloaded.min_location_per_seed() == 35
+    assert reloaded.min_location_by_range() == 46
+
+    Almanac.cached(TEST_ALMANAC.replace("79 14", "79 15"), tmp_path)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_cached_almanac_names(tmp_path):
+    text = TEST_ALMANAC.replace("seed-to", "grain-to").replace("-location", "-x")
+    Almanac.cached(text, tmp_path)
+    reloaded = Almanac.cached(text, tmp_path).map
+    assert (reloaded.source_name, reloaded.dest_name) == ("grain", "x")
+
+
+def test_cached_almanac_with_gaps(tmp_path):
+    text = """seeds: 5 10 150 100
+
+seed-to-soil map:
+100 0 10
+0 100 10
+200 300 5
+300 200 5"""
+    first = Almanac.cached(text, tmp_path)
+    reloaded = Almanac.cached(text, tmp_path)
+    assert isinstance(reloaded.map.breakpoints, np.memmap)
+    assert reloaded.map == first.map
+    assert len(reloaded.map.elements) == 4
+    assert reloaded.map.transform_many(range(0, 400)).tolist() == [
+        first.map.transform(x) for x in range(0, 400)
+    ]
+
+
+def test_cached_almanac_keeps_zero_offset_elements(tmp_path):
+    text = "seeds: 1 2\n\na-to-b map:\n10 0 10\n20 20 10\n70 40 10"
+    first = Almanac.cached(text, tmp_path)
+    assert first.map.elements[1] == Map.Elem(range(20, 30), 0)
+    assert Almanac.cached(text, tmp_path).map == first.map
+
+
+def test_cached_almanac_rebuilds_other_formats(tmp_path):
+    Almanac.cached(TEST_ALMANAC, tmp_path)
+    (path,) = tmp_path.iterdir()
+    assert path.name.startswith(f"almanac-v{CACHE_VERSION}-")
+    for stale in ([1, 4, 79, 14], "not an array"):
+        if isinstance(stale, str):
+            path.write_text(stale)
+        else:
+            np.save(path, np.array(stale, dtype=np.int64))
+        reloaded = Almanac.cached(TEST_ALMANAC, tmp_path)
+        assert reloaded.seeds == [79, 14, 55, 13]
+        assert reloaded.min_location_by_range() == 46
+        assert isinstance(Almanac.cached(TEST_ALMANAC, tmp_path).map.mapped, np.memmap)
+
+
 def test_almanac_min_location_in_seed_ranges(test_almanac):
     assert test_almanac.min_location_by_range() == 46
 
 
-@pytest.mark.skip(reason="Takes 45 min")
+def test_almanac_min_location_in_empty_seed_ranges():
+    almanac = Almanac(TEST_ALMANAC.replace("seeds: 79 14 55 13", "seeds: 79 0"))
+    assert almanac.min_location_by_range() is None
+
+
 def test_05b():
     with open("05_input.txt", encoding="utf-8") as f:
-        print("opening almanac")
         almanac = Almanac(f.read())
-        print("starting parse")
         assert almanac.min_location_by_range() == 52510809
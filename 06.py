@@ -1,5 +1,8 @@
 from functools import reduce
+from math import isqrt
 from operator import mul
+
+import numpy as np
 import pytest
 
 
@@ -8,15 +11,57 @@ def calc_distance(length, charge):
 
 
 def ways_to_win(time, distance):
-    return len([t for t in range(time) if calc_distance(time, t) > distance])
+    """
+    Count charge times t in range(time) where (time - t) * t > distance
+
+    The winning charge times lie strictly between the roots of
+    t**2 - time * t + distance = 0, so find the first one above the lower
+    root with exact integer arithmetic; the range is symmetric about time / 2.
+    """
+    if calc_distance(time, time // 2) <= distance:
+        return 0
+    # the lower root lies within half a step of this, so the first winning
+    # charge time is either it or the one after
+    first = max((time - isqrt(time * time - 4 * distance)) // 2, 0)
+    if calc_distance(time, first) <= distance:
+        first += 1
+    last = min(time - first, time - 1)
+    return max(last - first + 1, 0)
+
+
+def ways_to_win_many(times, distances):
+    """
+    ways_to_win for many races at once; races whose squared times might
+    overflow int64 are solved one by one with Python ints
+    """
+    times = np.asarray(times)
+    distances = np.asarray(distances)
+    if object in (times.dtype, distances.dtype) or (
+        times.size
+        and (np.abs(times).max() >= 2**30 or np.abs(distances).max() >= 2**58)
+    ):
+        results = [ways_to_win(int(t), int(d)) for t, d in zip(times, distances)]
+        return np.array(results, dtype=object)
+
+    time = times.astype(np.int64)
+    distance = distances.astype(np.int64)
+    discriminant = time * time - 4 * distance
+    root = np.floor(np.sqrt(np.maximum(discriminant, 0))).astype(np.int64)
+    first = np.maximum((time - root) // 2, 0)
+    # the float root can be out by one either way, and halving it by another
+    for _ in range(3):
+        first += (first <= time) & (calc_distance(time, first) <= distance)
+    first -= (first > 0) & (calc_distance(time, first - 1) > distance)
+    last = np.minimum(time - first, time - 1)
+    return np.where(discriminant < 0, 0, np.maximum(last - first + 1, 0))
 
 
 def score_input(text: str):
     times, distances = text.splitlines()
     times = [int(t) for t in times.split()[1:]]
     distances = [int(d) for d in distances.split()[1:]]
-    results = [ways_to_win(t, d) for t, d in zip(times, distances)]
-    return reduce(mul, results)
+    results = ways_to_win_many(times, distances)
+    return reduce(mul, results.tolist())
 
 
 def score_pt2(text: str):
@@ -40,7 +85,7 @@ def score_pt2(text: str):
     ],
 )
 def test_distance_calc(charge_time, distance):
-    assert distance(7, charge_time) == distance
+    assert calc_distance(7, charge_time) == distance
 
 
 @pytest.mark.parametrize(
@@ -50,6 +95,41 @@ def test_ways_to_win(time, distance, expected):
     assert ways_to_win(time, distance) == expected
 
 
+@pytest.mark.parametrize("time", range(12))
+def test_ways_to_win_matches_search(time):
+    for distance in range(-2, time * time // 4 + 2):
+        expected = len([t for t in range(time) if calc_distance(time, t) > distance])
+        assert ways_to_win(time, distance) == expected
+        assert ways_to_win_many([time], [distance]).tolist() == [expected]
+
+
+@pytest.mark.parametrize(
+    "time,distance", [(7, 12), (8, 16), (10**7, 25 * 10**12), (10**40, 10**80 // 4)]
+)
+def test_best_distance_only_ties(time, distance):
+    assert ways_to_win(time, distance) == 0
+    assert ways_to_win_many([time], [distance]).tolist() == [0]
+
+
+def test_ways_to_win_many():
+    times = [7, 15, 30, 0, 10**6]
+    distances = [9, 40, 200, 0, 10**11]
+    expected = [ways_to_win(t, d) for t, d in zip(times, distances)]
+    assert ways_to_win_many(times, distances).tolist() == expected
+    assert ways_to_win_many(times, distances).tolist() == [4, 8, 9, 0, 774597]
+
+
+def test_huge_race():
+    time = 10**40 + 7
+    distance = (time // 2) * (time - time // 2) - 10**30
+    ways = ways_to_win(time, distance)
+    first = (time + 1 - ways) // 2
+    assert calc_distance(time, first) > distance
+    assert calc_distance(time, first - 1) <= distance
+    assert calc_distance(time, time - first) > distance
+    assert ways_to_win_many([time], [distance]).tolist() == [ways]
+
+
 SAMPLE_INPUT = """\
 Time:      7  15   30
 Distance:  9  40  200"""
@@ -1,10 +1,19 @@
-from collections import Counter
+from collections import Counter, defaultdict
 from dataclasses import dataclass
 from enum import Enum
+from functools import cached_property, lru_cache
+from heapq import merge
+import io
+from itertools import islice
 from random import shuffle
+import tempfile
 
+import numpy as np
 import pytest
 
+CARD_VALUES = {"T": 10, "J": 11, "Q": 12, "K": 13, "A": 14}
+CARD_VALUES.update({str(n): n for n in range(2, 10)})
+
 
 @dataclass(frozen=True)
 class Hand:
@@ -26,42 +35,63 @@ class Hand:
     joker_wildcard: bool = False
 
     @classmethod
+    @lru_cache(maxsize=4096)
     def from_str(cls, cards, joker_wildcard=False):
         if len(cards) != 5:
             raise ValueError("Requires five cards")
         non_wildcards = cards
         if joker_wildcard:
             non_wildcards = non_wildcards.replace("J", "")
-        if non_wildcards:
-            pattern = Counter(non_wildcards).values()
-            pattern = sorted(pattern, reverse=True)
-            jokers = 5 - len(non_wildcards)
-            pattern[0] += jokers
-        else:
-            pattern = [5]
-        htype = next(t for t in cls.Type if t.pattern == tuple(pattern))
+        counts = tuple(sorted(Counter(non_wildcards).values(), reverse=True))
+        htype = HAND_TYPES[counts, 5 - len(non_wildcards)]
 
         return cls(cards=cards, htype=htype, joker_wildcard=joker_wildcard)
 
+    @classmethod
+    def classify(cls, counts: tuple[int, ...], jokers: int):
+        """Type of a hand from its non-joker card counts, largest first"""
+        pattern = list(counts) or [0]
+        pattern[0] += jokers
+        return next(t for t in cls.Type if t.pattern == tuple(pattern))
+
+    @cached_property
+    def key(self):
+        """Type rank then each card's value, as digits of a base-15 integer"""
+        key = self.htype.rank
+        for card in self.cards:
+            key = key * 15 + self.score_card(card)
+        return key
+
     def __lt__(self, other):
-        if self.htype.rank != other.htype.rank:
-            return self.htype.rank < other.htype.rank
-        for a, b in zip(self.cards, other.cards):
-            a = self.score_card(a)
-            b = other.score_card(b)
-            if a == b:
-                continue
-            return a < b
+        return self.key < other.key
 
     def score_card(self, text):
-        scores = {
-            "T": 10,
-            "J": 1 if self.joker_wildcard else 11,
-            "Q": 12,
-            "K": 13,
-            "A": 14,
-        }
-        return scores.get(text) or int(text)
+        if text == "J" and self.joker_wildcard:
+            return 1
+        return CARD_VALUES[text]
+
+
+def count_patterns(cards, largest=5):
+    """Every way to split `cards` into counts of at most `largest`, largest first"""
+    if not cards:
+        yield ()
+    for count in range(min(cards, largest), 0, -1):
+        for rest in count_patterns(cards - count, count):
+            yield (count, *rest)
+
+
+HAND_TYPES = {
+    (counts, 5 - cards): Hand.classify(counts, 5 - cards)
+    for cards in range(6)
+    for counts in count_patterns(cards)
+}
+
+
+def total_winnings(keys, bids):
+    """Sum of rank * bid, ranking by ascending Hand.key"""
+    order = np.argsort(np.asarray(keys, dtype=np.int64), kind="stable")
+    # total in Python ints, as rank * bid sums can pass int64
+    return sum(rank * bids[i] for rank, i in enumerate(order.tolist(), 1))
 
 
 def play(text, joker_wildcard=False):
@@ -71,8 +101,156 @@ def play(text, joker_wildcard=False):
         hand, bid = line.split()
         hand = Hand.from_str(hand, joker_wildcard)
         hand_bid[hand] = int(bid)
-    ranked_bids = (bid for _hand, bid in sorted(hand_bid.items()))
-    return sum(rank * bid for (rank, bid) in enumerate(ranked_bids, start=1))
+    return total_winnings([h.key for h in hand_bid], list(hand_bid.values()))
+
+
+def play_file(file, joker_wildcard=False, run_size=100_000, fan_in=32):
+    """
+    Total winnings of a hand/bid file in bounded memory, keeping every line
+
+    Runs of `run_size` (key, bid) records are sorted and spilled to temporary
+    files. Whenever `fan_in` runs of one size pile up they are merged into a
+    single bigger run, so only about fan_in * log(runs) files are open at
+    once. The last runs are merged back in key order while summing rank * bid.
+    """
+    levels = []  # runs holding run_size * fan_in ** level records each
+    try:
+        while lines := list(islice(file, run_size)):
+            records = []
+            for line in lines:
+                if line.strip():
+                    hand, bid = line.split()
+                    records.append((Hand.from_str(hand, joker_wildcard).key, int(bid)))
+            add_run(levels, write_run(sorted(records)), fan_in)
+
+        runs = [run for level in levels for run in level]
+        while len(runs) > fan_in:
+            runs.append(merge_runs(runs[:fan_in]))
+            runs = runs[fan_in:]
+        levels = [runs]
+
+        total = 0
+        ranked = merge(*(read_run(run) for run in runs))
+        for rank, (_key, bid) in enumerate(ranked, start=1):
+            total += rank * bid
+        return total
+    finally:
+        for level in levels:
+            for run in level:
+                run.close()
+
+
+def add_run(levels, run, fan_in):
+    level = 0
+    while True:
+        if level == len(levels):
+            levels.append([])
+        levels[level].append(run)
+        if len(levels[level]) < fan_in:
+            return
+        run = merge_runs(levels[level])
+        levels[level] = []
+        level += 1
+
+
+def merge_runs(runs):
+    """Merge sorted runs into a new run, closing them"""
+    merged = write_run(merge(*(read_run(run) for run in runs)))
+    for run in runs:
+        run.close()
+    return merged
+
+
+def write_run(records, block_records=256):
+    run = tempfile.TemporaryFile()
+    records = iter(records)
+    while block := list(islice(records, block_records)):
+        np.array(block, dtype=np.int64).tofile(run)
+    return run
+
+
+def read_run(run, block_records=256):
+    run.seek(0)
+    while block := run.read(16 * block_records):
+        yield from np.frombuffer(block, dtype=np.int64).reshape(-1, 2).tolist()
+
+
+class FenwickTree:
+    """Prefix sums over integer positions, stored sparsely"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = defaultdict(int)
+
+    def add(self, position, delta):
+        position += 1
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    def prefix_sum(self, stop):
+        """Sum of positions before `stop`"""
+        total = 0
+        while stop > 0:
+            total += self.tree.get(stop, 0)
+            stop -= stop & -stop
+        return total
+
+
+class Leaderboard:
+    """
+    Total winnings of a changing set of (hand, bid) entries
+
+    Entries rank by Hand.key, and identical hands by bid. Adding or removing
+    an entry shifts the rank of everything above it by one, so the total
+    changes by the entry's own rank * bid plus the sum of bids above it,
+    both of which come from Fenwick trees over (key, bid) positions.
+    """
+
+    BID_BITS = 32
+    POSITIONS = 8 * 15**5 << BID_BITS
+
+    def __init__(self, joker_wildcard=False):
+        self.joker_wildcard = joker_wildcard
+        self.counts = FenwickTree(self.POSITIONS)
+        self.bids = FenwickTree(self.POSITIONS)
+        self.bid_total = 0
+        self.total_winnings = 0
+
+    def add(self, hand: str | Hand, bid: int):
+        position = self._position(hand, bid)
+        self.total_winnings += self._rank_and_bids_above(position, bid)
+        self._update(position, 1, bid)
+        return self.total_winnings
+
+    def remove(self, hand: str | Hand, bid: int):
+        position = self._position(hand, bid)
+        if self.counts.prefix_sum(position + 1) == self.counts.prefix_sum(position):
+            raise KeyError(f"No entry for {hand} with bid {bid}")
+        self._update(position, -1, -bid)
+        self.total_winnings -= self._rank_and_bids_above(position, bid)
+        return self.total_winnings
+
+    def _position(self, hand, bid):
+        if not 0 <= bid < 1 << self.BID_BITS:
+            raise ValueError(f"Bid {bid} out of range")
+        if isinstance(hand, str):
+            hand = Hand.from_str(hand, self.joker_wildcard)
+        return hand.key << self.BID_BITS | bid
+
+    def _update(self, position, count, bid):
+        self.counts.add(position, count)
+        self.bids.add(position, bid)
+        self.bid_total += bid
+
+    def _rank_and_bids_above(self, position, bid):
+        """
+        rank * bid for an entry placed after any identical entries, plus the
+        bids of every entry ranked above it
+        """
+        rank = self.counts.prefix_sum(position + 1) + 1
+        bids_above = self.bid_total - self.bids.prefix_sum(position + 1)
+        return rank * bid + bids_above
 
 
 @pytest.mark.parametrize(
@@ -98,6 +276,17 @@ def test_categorise_hand(text, htype):
     assert Hand.from_str(text, joker_wildcard=True).htype == htype
 
 
+def test_hand_types_table():
+    assert len(HAND_TYPES) == 1 + 1 + 2 + 3 + 5 + 7
+    assert HAND_TYPES[(2, 1), 2] == Hand.Type.FOUR_OF_A_KIND
+    assert HAND_TYPES[(), 5] == Hand.Type.FIVE_OF_A_KIND
+
+
+def test_parsed_hands_cached():
+    assert Hand.from_str("KTJJT") is Hand.from_str("KTJJT")
+    assert Hand.from_str("KTJJT") is not Hand.from_str("KTJJT", True)
+
+
 @pytest.mark.parametrize(
     "text",
     [
@@ -114,6 +303,12 @@ def test_rank_hand(text):
     assert " ".join(h.cards for h in hands) == text
 
 
+def test_hand_key():
+    assert Hand.from_str("23456").key == int("123456", 15)
+    assert Hand.from_str("TJQKA").key == int("1abcde", 15)
+    assert Hand.from_str("TJQKA", joker_wildcard=True).key == int("2a1cde", 15)
+
+
 @pytest.mark.parametrize(
     "text,value, joker_wildcard",
     [
@@ -141,6 +336,15 @@ def test_winnings():
     assert play(SAMPLE_HANDS_BIDS) == 6440
 
 
+def test_total_winnings_past_int64():
+    keys = list(range(20_000))
+    shuffle(keys)
+    bids = [2**40 + key for key in keys]
+    expected = sum(rank * (2**40 + rank - 1) for rank in range(1, 20_001))
+    assert expected > np.iinfo(np.int64).max
+    assert total_winnings(keys, bids) == expected
+
+
 def test_07a():
     with open("07_input.txt", encoding="utf-8") as f:
         assert play(f.read()) == 251029473
@@ -153,3 +357,75 @@ def test_winnings_with_joker_wildcard():
 def test_07b():
     with open("07_input.txt", encoding="utf-8") as f:
         assert play(f.read(), joker_wildcard=True) == 251003917
+
+
+def test_play_file_keeps_duplicates():
+    assert play_file(io.StringIO(SAMPLE_HANDS_BIDS), run_size=2) == 6440
+    with_duplicate = SAMPLE_HANDS_BIDS + "32T3K 1\n"
+    assert play(with_duplicate) == 6440 - 765 + 1
+    # the extra 32T3K ranks first, so every other hand moves up one rank
+    everyone_up_one = 765 + 684 + 28 + 220 + 483
+    assert play_file(io.StringIO(with_duplicate)) == 1 + 6440 + everyone_up_one
+
+
+@pytest.mark.parametrize("joker_wildcard", [False, True])
+def test_07_play_file(joker_wildcard):
+    with open("07_input.txt", encoding="utf-8") as f:
+        expected = play(f.read(), joker_wildcard)
+        f.seek(0)
+        assert play_file(f, joker_wildcard, run_size=100) == expected
+        f.seek(0)
+        assert play_file(f, joker_wildcard, run_size=30, fan_in=3) == expected
+
+
+def test_merge_runs_caps_open_runs():
+    levels = []
+    for i in range(10):
+        add_run(levels, write_run([(i, i)]), fan_in=3)
+    assert [len(level) for level in levels] == [1, 0, 1]
+    assert list(read_run(levels[2][0])) == [[i, i] for i in range(9)]
+    for level in levels:
+        for run in level:
+            run.close()
+
+
+def test_leaderboard():
+    board = Leaderboard()
+    entries = [line.split() for line in SAMPLE_HANDS_BIDS.strip().splitlines()]
+    for hand, bid in entries:
+        board.add(hand, int(bid))
+    assert board.total_winnings == 6440
+    assert board.add("32T3K", 1) == 6440 + 1 + 765 + 684 + 28 + 220 + 483
+    assert board.remove("32T3K", 1) == 6440
+    assert board.remove("KK677", 28) == play(
+        SAMPLE_HANDS_BIDS.replace("KK677 28\n", "")
+    )
+    with pytest.raises(KeyError):
+        board.remove("KK677", 28)
+    with pytest.raises(ValueError):
+        board.add("KK677", -1)
+
+
+def test_leaderboard_duplicate_hands():
+    board = Leaderboard()
+    for bid in (5, 3, 5, 1):
+        board.add("KK677", bid)
+    assert board.total_winnings == 1 * 1 + 2 * 3 + 3 * 5 + 4 * 5
+    board.remove("KK677", 3)
+    assert board.total_winnings == 1 * 1 + 2 * 5 + 3 * 5
+    with pytest.raises(KeyError):
+        board.remove("KK677", 3)
+
+
+def test_07_leaderboard():
+    board = Leaderboard(joker_wildcard=True)
+    with open("07_input.txt", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        hand, bid = line.split()
+        board.add(hand, int(bid))
+    assert board.total_winnings == 251003917
+    for line in lines[::2]:
+        hand, bid = line.split()
+        board.remove(hand, int(bid))
+    assert board.total_winnings == play("\n".join(lines[1::2]), joker_wildcard=True)
@@ -1,7 +1,10 @@
+from array import array
 from dataclasses import dataclass
+from functools import cached_property
 import itertools
-from math import lcm
+from math import gcd
 
+import numpy as np
 import pytest
 
 
@@ -33,20 +36,246 @@ class Map:
         nodes = (cls.Node.from_str(x) for x in nodes.splitlines())
         return cls(seq, {n.name: n for n in nodes})
 
+    @cached_property
+    def compiled(self):
+        return CompiledMap.from_map(self)
+
     def count_steps(self, start="AAA", endswith="ZZZ"):
-        node = self.nodes[start]
-        for i, step in enumerate(itertools.cycle(self.sequence)):
-            if node.name.endswith(endswith):
-                return i
-            node = self.nodes[node.next(step)]
+        return self.compiled.count_steps(start, endswith)
 
     def count_ghost_steps(self):
-        # From each starting point, each path cycles
-        start_nodes = {n for n in self.nodes.values() if n.name.endswith("A")}
-        path_lengths = [
-            self.count_steps(start=n.name, endswith="Z") for n in start_nodes
-        ]
-        return lcm(*path_lengths)
+        # From each starting point, each path eventually cycles
+        start_nodes = [n for n in self.nodes if n.endswith("A")]
+        cycles = [self.compiled.ghost_cycle(n, endswith="Z") for n in start_nodes]
+        return first_common_step(cycles)
+
+    def lockstep_ghost_steps(self, max_steps=None):
+        start_nodes = [n for n in self.nodes if n.endswith("A")]
+        walkers = GhostWalkers(self.compiled, start_nodes, endswith="Z")
+        return walkers.run(max_steps)
+
+
+@dataclass(frozen=True)
+class GhostCycle:
+    """
+    Steps at which one ghost stands on a terminal node: each hit before `tail`
+    happens once, and each later hit repeats every `length` steps
+    """
+
+    tail: int
+    length: int
+    hits: list[int]
+
+    @property
+    def once(self):
+        return [h for h in self.hits if h < self.tail]
+
+    @property
+    def repeating(self):
+        return [(h, self.length) for h in self.hits if h >= self.tail]
+
+    def __contains__(self, step):
+        return step in self.once or any(in_progression(step, p) for p in self.repeating)
+
+
+def in_progression(step, progression):
+    start, period = progression
+    return step >= start and (step - start) % period == 0
+
+
+def intersect_progressions(a, b):
+    """
+    Progression (start, period) of the steps in both `a` and `b`, or None
+
+    Generalised CRT: x = start_a + k * period_a must also be start_b mod
+    period_b, which has a solution for k only if gcd(period_a, period_b)
+    divides the gap between the starts.
+    """
+    (start_a, period_a), (start_b, period_b) = a, b
+    g = gcd(period_a, period_b)
+    if (start_b - start_a) % g:
+        return None
+    period = period_a // g * period_b
+    k = (start_b - start_a) // g * pow(period_a // g, -1, period_b // g)
+    start = (start_a + period_a * k) % period
+    first = max(start_a, start_b)
+    if start < first:
+        start += (first - start + period - 1) // period * period
+    return start, period
+
+
+def first_common_step(cycles: list[GhostCycle]):
+    """First step at which every ghost is on a terminal node"""
+    once = set(cycles[0].once)
+    repeating = set(cycles[0].repeating)
+    for cycle in cycles[1:]:
+        once = {s for s in once if s in cycle} | {
+            s for s in cycle.once if any(in_progression(s, p) for p in repeating)
+        }
+        repeating = {
+            both
+            for a in repeating
+            for b in cycle.repeating
+            if (both := intersect_progressions(a, b))
+        }
+    steps = once | {start for start, _ in repeating}
+    if not steps:
+        raise ValueError("Ghosts are never all on terminal nodes at once")
+    return min(steps)
+
+
+@dataclass(frozen=True)
+class CompiledMap:
+    """Map with nodes numbered in order, for integer-indexed walks"""
+
+    names: list[str]
+    left: array
+    right: array
+    steps: bytes  # 0 for L, 1 for R
+
+    @classmethod
+    def from_map(cls, map_: Map):
+        names = list(map_.nodes)
+        ids = {name: i for i, name in enumerate(names)}
+        left = array("I", (ids[n.left] for n in map_.nodes.values()))
+        right = array("I", (ids[n.right] for n in map_.nodes.values()))
+        steps = bytes("LR".index(step) for step in map_.sequence)
+        return cls(names, left, right, steps)
+
+    @cached_property
+    def ids(self):
+        return {name: i for i, name in enumerate(self.names)}
+
+    def terminal_mask(self, endswith):
+        """Bitset of nodes whose names end with `endswith`, eight per byte"""
+        mask = bytearray((len(self.names) + 7) // 8)
+        for i, name in enumerate(self.names):
+            if name.endswith(endswith):
+                mask[i >> 3] |= 1 << (i & 7)
+        return mask
+
+    def ghost_cycle(self, start, endswith):
+        """
+        Walk from `start` until a (node, instruction index) state repeats, as
+        from then on the walk loops
+        """
+        node = self.ids[start]
+        terminal = self.terminal_mask(endswith)
+        next_node = (self.left, self.right)
+        seen = {}
+        hits = []
+        for i, step_index in enumerate(itertools.cycle(range(len(self.steps)))):
+            if (node, step_index) in seen:
+                tail = seen[node, step_index]
+                return GhostCycle(tail, i - tail, hits)
+            seen[node, step_index] = i
+            if terminal[node >> 3] >> (node & 7) & 1:
+                hits.append(i)
+            node = next_node[self.steps[step_index]][node]
+
+    def block_jumps(self, endswith):
+        return BlockJumps.from_compiled(self, endswith)
+
+    def count_steps(self, start="AAA", endswith="ZZZ"):
+        node = self.ids[start]
+        terminal = self.terminal_mask(endswith)
+        next_node = (self.left, self.right)
+        for i, step in enumerate(itertools.cycle(self.steps)):
+            if terminal[node >> 3] >> (node & 7) & 1:
+                return i
+            node = next_node[step][node]
+
+
+@dataclass(frozen=True)
+class BlockJumps:
+    """
+    Jump tables over whole instruction blocks, for very long walks
+
+    first_hit[node] is the first step within a block from `node` that lands on
+    a terminal node (-1 if none). Level k of `jumps` and `hits` holds where
+    2**k blocks from each node lead, and whether they pass a terminal node.
+    """
+
+    ids: dict[str, int]
+    block_length: int
+    first_hit: list[int]
+    jumps: list[list[int]]
+    hits: list[list[bool]]
+
+    @classmethod
+    def from_compiled(cls, compiled: CompiledMap, endswith):
+        left = np.asarray(compiled.left, dtype=np.int64)
+        right = np.asarray(compiled.right, dtype=np.int64)
+        terminal = np.array([n.endswith(endswith) for n in compiled.names])
+
+        # walk one block from every node at once
+        node = np.arange(len(compiled.names))
+        first_hit = np.full(node.size, -1)
+        for i, step in enumerate(compiled.steps):
+            first_hit[(first_hit < 0) & terminal[node]] = i
+            node = right[node] if step else left[node]
+
+        jumps = [node]
+        hits = [first_hit >= 0]
+        # a walk over blocks repeats a node within len(names) blocks
+        for _ in range(max(node.size.bit_length(), 1)):
+            jump, hit = jumps[-1], hits[-1]
+            jumps.append(jump[jump])
+            hits.append(hit | hit[jump])
+        return cls(
+            compiled.ids,
+            len(compiled.steps),
+            first_hit.tolist(),
+            [j.tolist() for j in jumps],
+            [h.tolist() for h in hits],
+        )
+
+    def count_steps(self, start="AAA"):
+        node = self.ids[start]
+        blocks = 0
+        for level in reversed(range(len(self.jumps))):
+            if not self.hits[level][node]:
+                node = self.jumps[level][node]
+                blocks += 1 << level
+        if self.first_hit[node] < 0:
+            raise ValueError(f"No terminal node is reachable from {start}")
+        return blocks * self.block_length + self.first_hit[node]
+
+
+class GhostWalkers:
+    """
+    Many walkers stepping through a CompiledMap together, one array gather per
+    instruction, noting the first step and number of times each is terminal
+    """
+
+    def __init__(self, compiled: CompiledMap, starts: list[str], endswith="Z"):
+        self.steps = compiled.steps
+        self.next_node = (
+            np.asarray(compiled.left, dtype=np.int64),
+            np.asarray(compiled.right, dtype=np.int64),
+        )
+        self.terminal = np.array([n.endswith(endswith) for n in compiled.names])
+        self.nodes = np.array([compiled.ids[s] for s in starts], dtype=np.int64)
+        self.step = 0
+        self.first_hits = np.full(len(starts), -1)
+        self.hit_counts = np.zeros(len(starts), dtype=np.int64)
+
+    def advance(self):
+        """Note which walkers are terminal at the current step, then move all"""
+        on_terminal = self.terminal[self.nodes]
+        self.first_hits[(self.first_hits < 0) & on_terminal] = self.step
+        self.hit_counts += on_terminal
+        step = self.steps[self.step % len(self.steps)]
+        self.nodes = self.next_node[step][self.nodes]
+        self.step += 1
+        return on_terminal.all()
+
+    def run(self, max_steps=None):
+        """Step until every walker is terminal at once, returning that step"""
+        while max_steps is None or self.step <= max_steps:
+            if self.advance():
+                return self.step - 1
+        return None
 
 
 def test_parse_node():
@@ -100,10 +329,116 @@ def test_08a():
         assert Map.from_str(f.read()).count_steps() == 17287
 
 
+def test_compiled_map():
+    compiled = Map.from_str(SAMPLE_2).compiled
+    assert compiled.names == ["AAA", "BBB", "ZZZ"]
+    assert list(compiled.left) == [1, 0, 2]
+    assert list(compiled.right) == [1, 2, 2]
+    assert compiled.steps == bytes([0, 0, 1])
+    assert compiled.terminal_mask("Z") == bytearray([0b100])
+
+
+@pytest.mark.parametrize("text,steps", [(SAMPLE_1, 2), (SAMPLE_2, 6)])
+def test_block_jump_step_count(text, steps):
+    compiled = Map.from_str(text).compiled
+    assert compiled.block_jumps("ZZZ").count_steps() == steps
+
+
+def test_block_jumps_unreachable():
+    jumps = Map.from_str(SAMPLE_1).compiled.block_jumps("GGG")
+    with pytest.raises(ValueError):
+        jumps.count_steps("BBB")
+
+
+def test_08a_block_jumps():
+    with open("08_input.txt", encoding="utf-8") as f:
+        compiled = Map.from_str(f.read()).compiled
+        assert compiled.block_jumps("ZZZ").count_steps() == 17287
+
+
 def test_ghost_steps():
     assert Map.from_str(SAMPLE_3).count_ghost_steps() == 6
 
 
+# 11A reaches 11Z at step 2 and then every 2 steps, 22A reaches 22Z at step 1
+# and then every 3 steps, so the LCM of first hits (2) is wrong
+GHOSTS_11 = """
+11A = (11B, 11B)
+11B = (11Z, 11Z)
+11Z = (11B, 11B)
+"""
+GHOSTS_22 = """
+22A = (22Z, 22Z)
+22Z = (22B, 22B)
+22B = (22C, 22C)
+22C = (22Z, 22Z)
+"""
+# 33A passes 33Z at step 1, and never again
+GHOSTS_33 = """
+33A = (33Z, 33Z)
+33Z = (33B, 33B)
+33B = (33B, 33B)
+"""
+
+
+def ghost_map(*ghosts):
+    return Map.from_str("L\n\n" + "".join(g.strip() + "\n" for g in ghosts))
+
+
+def lockstep_ghost_steps(map_: Map):
+    nodes = [n for n in map_.nodes.values() if n.name.endswith("A")]
+    for i, step in enumerate(itertools.cycle(map_.sequence)):
+        if all(n.name.endswith("Z") for n in nodes):
+            return i
+        nodes = [map_.nodes[n.next(step)] for n in nodes]
+
+
+def test_ghost_cycle():
+    compiled = ghost_map(GHOSTS_11, GHOSTS_22, GHOSTS_33).compiled
+    assert compiled.ghost_cycle("11A", "Z") == GhostCycle(1, 2, [2])
+    assert compiled.ghost_cycle("22A", "Z") == GhostCycle(1, 3, [1])
+    assert compiled.ghost_cycle("33A", "Z") == GhostCycle(2, 1, [1])
+
+
+def test_intersect_progressions():
+    assert intersect_progressions((2, 2), (1, 3)) == (4, 6)
+    assert intersect_progressions((10, 4), (1, 3)) == (10, 12)
+    assert intersect_progressions((0, 4), (1, 2)) is None
+
+
+def test_ghost_steps_without_aligned_cycles():
+    map_ = ghost_map(GHOSTS_11, GHOSTS_22)
+    assert map_.count_ghost_steps() == lockstep_ghost_steps(map_) == 4
+
+
+def test_ghost_walkers():
+    map_ = ghost_map(GHOSTS_11, GHOSTS_22, GHOSTS_33)
+    walkers = GhostWalkers(map_.compiled, ["11A", "22A", "33A"])
+    assert walkers.run(max_steps=20) is None
+    assert walkers.first_hits.tolist() == [2, 1, 1]
+    assert walkers.hit_counts.tolist() == [10, 7, 1]
+
+
+@pytest.mark.parametrize(
+    "map_",
+    [
+        Map.from_str(SAMPLE_3),
+        ghost_map(GHOSTS_11, GHOSTS_22),
+        ghost_map(GHOSTS_22, GHOSTS_33),
+    ],
+)
+def test_vectorised_lockstep(map_):
+    assert map_.lockstep_ghost_steps() == lockstep_ghost_steps(map_)
+    assert map_.lockstep_ghost_steps() == map_.count_ghost_steps()
+
+
+def test_ghost_steps_with_one_off_hits():
+    map_ = ghost_map(GHOSTS_22, GHOSTS_33)
+    assert map_.count_ghost_steps() == lockstep_ghost_steps(map_) == 1
+    with pytest.raises(ValueError):
+        ghost_map(GHOSTS_11, GHOSTS_33).count_ghost_steps()
+
+
 def test_08b():
     with open("08_input.txt", encoding="utf-8") as f:
         assert Map.from_str(f.read()).count_ghost_steps() == 18625484023687
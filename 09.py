@@ -1,3 +1,10 @@
+from collections import defaultdict
+from functools import cache
+from math import comb
+from operator import mul
+import timeit
+
+import numpy as np
 import pytest
 
 
@@ -10,20 +17,86 @@ def build_sequences(history: str):
     return result[:-1]
 
 
+@cache
+def next_weights(length: int):
+    """
+    Weights giving the next value of a history directly
+
+    Summing the last value of every difference row is the Newton form of the
+    degree < length polynomial through the history; expanded, the value at
+    `length` is sum((-1) ** (length - 1 - i) * comb(length, i) * h[i]).
+    """
+    return tuple((-1) ** (length - 1 - i) * comb(length, i) for i in range(length))
+
+
+@cache
+def prev_weights(length: int):
+    # extrapolating backwards is extrapolating the reversed history forwards
+    return next_weights(length)[::-1]
+
+
 def next_value(history: str):
-    sequences = build_sequences(history)
-    return sum(s[-1] for s in sequences)
+    history = [int(x) for x in history.split()]
+    return sum(map(mul, next_weights(len(history)), history))
 
 
 def prev_value(history: str):
-    sequences = build_sequences(history)
-    return sum(-s[0] if i % 2 else s[0] for (i, s) in enumerate(sequences))
+    history = [int(x) for x in history.split()]
+    return sum(map(mul, prev_weights(len(history)), history))
 
 
 def sum_text(text, value_fn):
     return sum(value_fn(line) for line in text.strip().splitlines())
 
 
+def edge_values(histories: np.ndarray, backwards=False):
+    """Next (or previous) value of every row of a 2-D array of histories"""
+    total = np.zeros(len(histories), dtype=histories.dtype)
+    sign = 1
+    rows = histories
+    while rows.shape[1]:
+        if backwards:
+            total += sign * rows[:, 0]
+            sign = -sign
+        else:
+            total += rows[:, -1]
+        rows = np.diff(rows, axis=1)
+    return total
+
+
+def sum_text_batched(text, backwards=False):
+    """
+    sum_text with histories of each length parsed and differenced together
+    as one array
+
+    Differences of a row of n values below M in size stay below 2**n * M, so
+    only rows where that could pass the int64 range are extrapolated one at a
+    time with Python ints.
+    """
+    by_length = defaultdict(list)
+    for line in text.strip().splitlines():
+        by_length[line.count(" ") + 1].append(line)
+
+    value_fn = prev_value if backwards else next_value
+    total = 0
+    for length, lines in by_length.items():
+        # values past int64 parse as its min or max, which fail the check below
+        histories = np.fromstring(" ".join(lines), dtype=np.int64, sep=" ")
+        if histories.size != len(lines) * length:
+            # some line is spaced unevenly
+            total += sum(value_fn(line) for line in lines)
+            continue
+        histories = histories.reshape(len(lines), length)
+        limit = 2 ** (63 - length)
+        safe = (np.abs(histories).max(axis=1) < limit) & (
+            histories.min(axis=1) > -limit
+        )
+        total += sum(value_fn(lines[i]) for i in np.flatnonzero(~safe).tolist())
+        # rows are each safe in int64, but their total may not be
+        total += sum(edge_values(histories[safe], backwards).tolist())
+    return total
+
+
 @pytest.mark.parametrize(
     "history,value",
     [
@@ -48,6 +121,57 @@ def test_extrapolate_backwards(history, value):
     assert prev_value(history) == value
 
 
+def test_weights():
+    assert next_weights(3) == (1, -3, 3)
+    assert prev_weights(3) == (3, -3, 1)
+
+
+@pytest.mark.parametrize(
+    "history", ["5", "1 2", "3 1 4 1 5 9 2 6", "0 3 6 9 12 15", "-4 -8 -15 -27"]
+)
+def test_weights_match_difference_rows(history):
+    sequences = build_sequences(history)
+    assert next_value(history) == sum(s[-1] for s in sequences)
+    assert prev_value(history) == sum(
+        -s[0] if i % 2 else s[0] for (i, s) in enumerate(sequences)
+    )
+
+
+def test_edge_values():
+    histories = np.array([[0, 3, 6, 9, 12, 15], [1, 3, 6, 10, 15, 21]])
+    assert edge_values(histories).tolist() == [18, 28]
+    assert edge_values(histories, backwards=True).tolist() == [-3, 0]
+
+
+@pytest.mark.parametrize("backwards", [False, True])
+def test_batched_overflow_falls_back(backwards):
+    text = "1 3 6\n-4 -8 -15 -27\n9223372036854775807 0 9223372036854775807\n7"
+    text += "\n1 -99999999999999999999 2\n99999999999999999999 5 6"
+    value_fn = prev_value if backwards else next_value
+    assert sum_text_batched(text, backwards) == sum_text(text, value_fn)
+
+
+@pytest.mark.parametrize("backwards", [False, True])
+def test_batched_total_overflow(backwards):
+    text = "4611686018427387903\n" * 4
+    assert sum_text_batched(text, backwards) == 18446744073709551612
+
+
+@pytest.mark.parametrize("backwards", [False, True])
+def test_batched_uneven_spacing(backwards):
+    text = "1 3 6\n1  3 6 10\n 0 3 6 9\n10 13 16"
+    value_fn = prev_value if backwards else next_value
+    assert sum_text_batched(text, backwards) == sum_text(text, value_fn)
+
+
+def test_batched_faster():
+    with open("09_input.txt", encoding="utf-8") as f:
+        text = f.read() * 20
+    one_at_a_time = min(timeit.repeat(lambda: sum_text(text, next_value), number=1))
+    batched = min(timeit.repeat(lambda: sum_text_batched(text), number=1))
+    assert batched < one_at_a_time
+
+
 def test_09a():
     with open("09_input.txt", encoding="utf-8") as f:
         assert sum_text(f.read(), next_value) == 1969958987
@@ -56,3 +180,9 @@ def test_09a():
 def test_09b():
     with open("09_input.txt", encoding="utf-8") as f:
         assert sum_text(f.read(), prev_value) == 1068
+
+
+@pytest.mark.parametrize("backwards,total", [(False, 1969958987), (True, 1068)])
+def test_09_batched(backwards, total):
+    with open("09_input.txt", encoding="utf-8") as f:
+        assert sum_text_batched(f.read(), backwards) == total